@@ -1,235 +1,453 @@
 import argparse
 import gitlab
+import requests
 import json
 import re
 import logging
 import difflib
 import base64
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# GitLab allows 10 API requests per second per IP, keep some headroom
+GITLAB_REQUESTS_PER_SECOND = float(os.environ.get('GITLAB_REQUESTS_PER_SECOND', 8))
+# Pause once fewer requests than this remain in the server-side rate limit window
+GITLAB_RATE_LIMIT_THRESHOLD = 10
+
+
+# Short project names used in Jira that differ from the names in projects.tf
+PROJECT_KEYWORD_ALIASES = {'ml': 'machinelearning'}
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_project_pattern(project_keywords):
+    """Compiles the regex matching a block of any of the projects with its cores and ram values."""
+    alternatives = '|'.join(map(re.escape, project_keywords))
+    return re.compile(
+        rf'(?ms)(name\s*=\s*"(?P<name>[^"]*(?:{alternatives})[^"]*)".*?cores(\s*)=(\s*)(?P<cores>\d+).*?ram(\s*)=(\s*)(?P<ram>\d+))'
+    )
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting how many requests are sent per second."""
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError(f"Request rate must be positive, got {rate}.")
+        self.rate = rate
+        # At least one token must fit in the bucket, otherwise rates below 1 req/s would never grant a request
+        self.capacity = max(1, capacity or rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause_until(self, timestamp):
+        """Holds back all requests until the given wall-clock timestamp."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, timestamp)
+
+    def acquire(self):
+        """Blocks until a token is available and takes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                wait = max(self.paused_until - time.time(), 0.0)
+                if not wait and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                if not wait:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimitedSession(requests.Session):
+    """Session sending requests through a shared token bucket and honoring GitLab rate limit headers."""
+
+    def __init__(self, bucket):
+        super().__init__()
+        self.bucket = bucket
+
+    def send(self, request, **kwargs):
+        self.bucket.acquire()
+        response = super().send(request, **kwargs)
+
+        try:
+            remaining = int(response.headers['RateLimit-Remaining'])
+            reset = float(response.headers['RateLimit-Reset'])
+        except (KeyError, ValueError):
+            # Missing or malformed headers, e.g. rewritten by a proxy
+            return response
+
+        if remaining < GITLAB_RATE_LIMIT_THRESHOLD:
+            logger.warning("GitLab rate limit almost exhausted (%s left), pausing until %s.", remaining, reset)
+            self.bucket.pause_until(reset)
+        return response
+
+
+def build_session(bucket, pool_maxsize=16):
+    """Creates a rate limited keep-alive HTTP session with connection pooling and retries for transient errors."""
+    session = RateLimitedSession(bucket)
+    adapter = HTTPAdapter(
+        pool_maxsize=pool_maxsize,
+        # Only idempotent methods are resent: a POST failing after GitLab applied it would create a duplicate
+        # commit or merge request, so write retries are left to python-gitlab
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset(['GET', 'PUT', 'DELETE'])
+        )
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
 
 class GitLabManager:
     def __init__(self, url, token, project_id, tasks):
         """Initializes the GitLabManager with the necessary configuration."""
+        self.workers = int(os.environ.get('GITLAB_WORKERS', 8))
+        # Shared by all worker threads so the whole run stays within the GitLab rate limit
+        self.bucket = TokenBucket(GITLAB_REQUESTS_PER_SECOND)
         try:
-            self.gl = gitlab.Gitlab(url=url, private_token=token)
+            # Keep up to one idle connection per worker in the GitLab host pool so no thread discards one
+            self.session = build_session(self.bucket, pool_maxsize=self.workers)
+            self.gl = gitlab.Gitlab(url=url, private_token=token, session=self.session)
             self.gl.auth()
-            logging.info("Successfully connected to GitLab.")
+            logger.info("Successfully connected to GitLab.")
         except gitlab.exceptions.GitlabAuthenticationError as e:
-            logging.error(f"GitLab authentication failed: {e}")
+            logger.error("GitLab authentication failed: %s", e)
             self.gl = None
             self.project = None
             return
         except Exception as e:
-            logging.error(f"An error occurred while connecting to GitLab: {e}")
+            logger.error("An error occurred while connecting to GitLab: %s", e)
             self.gl = None
             self.project = None
             return
 
         try:
             self.project = self.gl.projects.get(project_id)
-            logging.info(f"Accessed GitLab project: {self.project.name}")
+            logger.info("Accessed GitLab project: %s", self.project.name)
         except gitlab.exceptions.GitlabGetError as e:
-            logging.error(f"Failed to get GitLab project: {e}")
+            logger.error("Failed to get GitLab project: %s", e)
             self.project = None
         except Exception as e:
-            logging.error(f"An error occurred while accessing the GitLab project: {e}")
+            logger.error("An error occurred while accessing the GitLab project: %s", e)
             self.project = None
 
         self.tasks = tasks
+        self._lock = threading.Lock()
+        # Head commit of each branch created by this run and file contents keyed by (file_path, commit_sha)
+        self._branch_heads = {}
+        self._file_cache = {}
 
     def create_branch(self, branch_name, ref_branch='master'):
         """Creates a new branch from the specified reference branch. If the branch exists, reset it to ref_branch."""
         try:
-            branch = self.project.branches.get(branch_name)
+            branch = self.project.branches.create({'branch': branch_name, 'ref': ref_branch})
+        except gitlab.exceptions.GitlabCreateError as e:
+            if e.response_code != 400 or 'already exists' not in str(e.error_message):
+                raise
             # Delete and recreate the branch from ref_branch
-            branch.delete()
-            logging.info(f"Branch '{branch_name}' deleted.")
-        except gitlab.exceptions.GitlabGetError:
-            # Branch does not exist, proceed to create it
-            pass
-
-        # Create the branch from ref_branch
-        self.project.branches.create({'branch': branch_name, 'ref': ref_branch})
-        logging.info(f"Branch '{branch_name}' successfully created from '{ref_branch}'.")
+            self.project.branches.delete(branch_name)
+            logger.info("Branch '%s' deleted.", branch_name)
+            branch = self.project.branches.create({'branch': branch_name, 'ref': ref_branch})
+
+        with self._lock:
+            self._branch_heads[branch_name] = branch.commit['id']
+        logger.info("Branch '%s' successfully created from '%s'.", branch_name, ref_branch)
+
+    def get_head_commit(self, branch_name):
+        """Returns the id of the latest commit on the specified branch."""
+        with self._lock:
+            commit_sha = self._branch_heads.get(branch_name)
+        if commit_sha is None:
+            commit_sha = self.project.commits.list(ref_name=branch_name, per_page=1, get_all=False)[0].id
+        return commit_sha
+
+    def _download_file(self, file_path, ref):
+        """Downloads the raw file content, falling back to the base64 files API on older GitLab versions."""
+        try:
+            return self.project.files.raw(file_path=file_path, ref=ref).decode('utf-8')
+        except gitlab.exceptions.GitlabGetError as e:
+            if e.response_code == 404:
+                raise
+            logger.warning("Raw file download failed (%s), retrying with the files API.", e)
+            file = self.project.files.get(file_path=file_path, ref=ref)
+            return base64.b64decode(file.content).decode('utf-8')
 
     def get_file_content(self, file_path, branch_name):
-        """Retrieves the content of the specified file from the project."""
+        """Retrieves the content of the specified file from the project, reusing it while the branch head is unchanged."""
         try:
-            file = self.project.files.get(file_path=file_path, ref=branch_name)
-            content = base64.b64decode(file.content).decode('utf-8')
-            logging.info(f"Retrieved file '{file_path}' from branch '{branch_name}'.")
+            commit_sha = self.get_head_commit(branch_name)
+            with self._lock:
+                content = self._file_cache.get((file_path, commit_sha))
+            if content is not None:
+                logger.info("Using cached file '%s' at commit '%s'.", file_path, commit_sha)
+                return content
+
+            content = self._download_file(file_path, commit_sha)
+            with self._lock:
+                self._file_cache[(file_path, commit_sha)] = content
+            logger.info("Retrieved file '%s' from branch '%s'.", file_path, branch_name)
             return content
         except gitlab.exceptions.GitlabGetError as e:
-            logging.error(f"Failed to retrieve file: {e}")
+            logger.error("Failed to retrieve file: %s", e)
             return None
         except Exception as e:
-            logging.error(f"Error retrieving file: {e}")
+            logger.error("Error retrieving file: %s", e)
             return None
 
     def modify_project(self, content, project_keyword, cpu, ram):
-        """Modifies the cores and ram values for a project without altering the whitespace around the equal sign."""
-        if project_keyword == 'ml':
-            project_keyword = 'machinelearning'
-
-        project_pattern = rf'(?ms)(name\s*=\s*"[^"]*{project_keyword}[^"]*".*?cores(\s*)=(\s*)(\d+).*?ram(\s*)=(\s*)(\d+))'
-
-        def update_cores_ram(match):
-            original_block = match.group(1)
-            cores_before_equals = match.group(2)  # Capture whitespace before cores' equal sign
-            cores_after_equals = match.group(3)   # Capture whitespace after cores' equal sign
-            current_cores = int(match.group(4))
-
-            ram_before_equals = match.group(5)    # Capture whitespace before ram's equal sign
-            ram_after_equals = match.group(6)     # Capture whitespace after ram's equal sign
-            current_ram = int(match.group(7))
-
-            new_cores = current_cores + int(cpu)
-            new_ram = current_ram + int(ram)
-
-            # Replace only the numbers, preserving whitespace around equal signs
-            modified_block = re.sub(
-                r'cores(\s*)=(\s*)\d+', 
-                f"cores{cores_before_equals}={cores_after_equals}{new_cores}", 
-                original_block
-            )
-            modified_block = re.sub(
-                r'ram(\s*)=(\s*)\d+', 
-                f"ram{ram_before_equals}={ram_after_equals}{new_ram}", 
-                modified_block
-            )
-
-            logging.info(f"Modified project matching '{project_keyword}' with CPU +{cpu} and RAM +{ram}.")
-            return modified_block
-
-        modified_content = re.sub(project_pattern, update_cores_ram, content)
-        if modified_content == content:
-            logging.warning(f"No matching project found or modified for keyword '{project_keyword}'.")
-        return modified_content
-
-    def commit_changes(self, file_path, original_content, modified_content, branch_name, commit_message):
-        """Commits the modified content back to the specified branch."""
+        """Modifies the cores and ram values for a project without altering the whitespace around the equal sign.
+
+        :param cpu: Integer number of cores to add.
+        :param ram: Integer amount of RAM in MB to add.
+        """
+        return self.modify_project_batch(content, {project_keyword: (cpu, ram)})
+
+    def modify_project_batch(self, content, deltas):
+        """Modifies the cores and ram values of several projects in a single pass over the content.
+
+        :param deltas: Mapping of project keyword to a tuple of integer cores and RAM in MB to add.
+        """
+        normalized_deltas = {}
+        for project_keyword, (cpu, ram) in deltas.items():
+            project_keyword = PROJECT_KEYWORD_ALIASES.get(project_keyword, project_keyword)
+            total_cpu, total_ram = normalized_deltas.get(project_keyword, (0, 0))
+            normalized_deltas[project_keyword] = (total_cpu + cpu, total_ram + ram)
+
+        project_pattern = _compile_project_pattern(tuple(sorted(normalized_deltas)))
+
+        # Single scan over the content, splicing new values in at the captured number positions
+        parts = []
+        position = 0
+        matched_keywords = set()
+        for match in project_pattern.finditer(content):
+            # A project name may contain several keywords, each of them adds its delta
+            cpu = ram = 0
+            for project_keyword, (keyword_cpu, keyword_ram) in normalized_deltas.items():
+                if project_keyword in match['name']:
+                    cpu += keyword_cpu
+                    ram += keyword_ram
+                    matched_keywords.add(project_keyword)
+                    logger.info(
+                        "Modified project matching '%s' with CPU +%s and RAM +%s.", project_keyword, keyword_cpu, keyword_ram
+                    )
+
+            new_cores = int(match.group('cores')) + cpu
+            new_ram = int(match.group('ram')) + ram
+            parts.extend((
+                content[position:match.start('cores')], str(new_cores),
+                content[match.end('cores'):match.start('ram')], str(new_ram)
+            ))
+            position = match.end('ram')
+
+        parts.append(content[position:])
+        for project_keyword in normalized_deltas.keys() - matched_keywords:
+            logger.warning("No matching project found or modified for keyword '%s'.", project_keyword)
+        return ''.join(parts)
+
+    def commit_changes(self, files, branch_name, commit_message):
+        """Commits the modified content of all files back to the specified branch in a single commit.
+
+        :param files: Mapping of file path to a tuple of original and modified content.
+        """
+        changed_files = {
+            file_path: (original_content, modified_content)
+            for file_path, (original_content, modified_content) in files.items()
+            if modified_content != original_content
+        }
+        if not changed_files:
+            logger.info("Content of %s is unchanged, skipping commit to '%s'.", ', '.join(files), branch_name)
+            return
+
         try:
-            # Ensure content is properly formatted as a string
-            if not isinstance(modified_content, str):
-                modified_content = str(modified_content)
-            modified_content = modified_content.encode('utf-8').decode('utf-8')
-
-            logging.info(f"Committing to branch '{branch_name}' with file path '{file_path}' with message: '{commit_message}'")
-
-            # Log differences between original and modified content
-            diff = difflib.unified_diff(
-                original_content.splitlines(),
-                modified_content.splitlines(),
-                fromfile='original',
-                tofile='modified',
-                lineterm=''
-            )
-            diff_text = '\n'.join(diff)
-            logging.info(f"Differences between original and modified content:\n{diff_text}")
+            actions = []
+            for file_path, (original_content, modified_content) in changed_files.items():
+                # Ensure content is properly formatted as a string
+                if not isinstance(modified_content, str):
+                    modified_content = str(modified_content)
+                modified_content = modified_content.encode('utf-8').decode('utf-8')
+
+                logger.info("Committing to branch '%s' with file path '%s' with message: '%s'", branch_name, file_path, commit_message)
+
+                # Diffing large files is expensive, so only do it when the diff will actually be logged
+                if logger.isEnabledFor(logging.DEBUG):
+                    diff = difflib.unified_diff(
+                        original_content.splitlines(),
+                        modified_content.splitlines(),
+                        fromfile='original',
+                        tofile='modified',
+                        lineterm=''
+                    )
+                    logger.debug("Differences between original and modified content:\n%s", '\n'.join(diff))
+
+                actions.append({
+                    'action': 'update',
+                    'file_path': file_path,
+                    'content': modified_content
+                })
 
             # Use the pre-initialized commit message
             self.project.commits.create({
                 'branch': branch_name,
                 'commit_message': commit_message,
-                'actions': [
-                    {
-                        'action': 'update',
-                        'file_path': file_path,
-                        'content': modified_content
-                    }
-                ]
+                'actions': actions
             })
-            logging.info(f"Changes committed to branch '{branch_name}'.")
+            with self._lock:
+                self._branch_heads.pop(branch_name, None)
+            logger.info("Changes committed to branch '%s'.", branch_name)
 
         except gitlab.exceptions.GitlabCreateError as e:
-            logging.error(f"Failed to commit changes: {e} - This may be due to custom hooks or branch protection rules.")
+            logger.error("Failed to commit changes: %s - This may be due to custom hooks or branch protection rules.", e)
         except TypeError as e:
-            logging.error(f"TypeError occurred: {e} - Ensure all commit parameters match GitLab API requirements.")
+            logger.error("TypeError occurred: %s - Ensure all commit parameters match GitLab API requirements.", e)
         except Exception as e:
-            logging.error(f"An error occurred while committing the changes: {e} ({type(e)})")
+            logger.error("An error occurred while committing the changes: %s (%s)", e, type(e))
 
-    def create_merge_request(self, branch_name, commit_message):
-        """Creates or updates a merge request with the correct title."""
+    def find_merge_requests(self, branch_name):
+        """Returns the open merge requests from the specified branch to 'master'."""
+        return self.project.mergerequests.list(
+            source_branch=branch_name, target_branch='master', state='opened', get_all=False
+        )
+
+    def create_merge_request(self, branch_name, commit_message, existing_mrs=None):
+        """Creates or updates a merge request with the correct title, reusing already fetched open merge requests."""
         try:
-            existing_mrs = self.project.mergerequests.list(
-                source_branch=branch_name, target_branch='master', state='opened'
-            )
+            if existing_mrs is None:
+                existing_mrs = self.find_merge_requests(branch_name)
 
             if existing_mrs:
                 existing_mr = existing_mrs[0]
                 if existing_mr.title != commit_message:
-                    logging.info(
-                        f"Updating MR title from '{existing_mr.title}' to '{commit_message}'."
+                    logger.info(
+                        "Updating MR title from '%s' to '%s'.", existing_mr.title, commit_message
                     )
                     existing_mr.title = commit_message
                     existing_mr.save()
                 else:
-                    logging.info(f"Merge Request with title '{commit_message}' already exists.")
+                    logger.info("Merge Request with title '%s' already exists.", commit_message)
             else:
                 mr = self.project.mergerequests.create({
                     'source_branch': branch_name,
                     'target_branch': 'master',
                     'title': commit_message
                 })
-                logging.info(f"Merge Request created: {mr.web_url}")
+                logger.info("Merge Request created: %s", mr.web_url)
 
         except gitlab.exceptions.GitlabCreateError as e:
-            logging.error(f"Failed to create or update Merge Request: {e}")
+            logger.error("Failed to create or update Merge Request: %s", e)
         except Exception as e:
-            logging.error(f"Error creating or updating Merge Request: {e}")
+            logger.error("Error creating or updating Merge Request: %s", e)
 
     def load_tasks(self):
         """Loads task data from the provided list."""
         try:
-            self.task_keys = sorted([task['key'] for task in self.tasks])
-            logging.info(f"Loaded tasks: {self.tasks}")
+            with self._lock:
+                self.task_keys = sorted([task['key'] for task in self.tasks])
+            logger.info("Loaded tasks: %s", self.tasks)
             return self.tasks
         except Exception as e:
-            logging.error(f"Failed to load tasks: {e}")
+            logger.error("Failed to load tasks: %s", e)
             return []
 
-    def process_tasks(self):
-        """Processes each task: creates a branch, modifies files, commits changes, and creates a merge request."""
-        if self.project is None:
-            logging.error("GitLab project is not initialized. Exiting process_tasks.")
-            return
-
+    def group_tasks(self):
+        """Groups tasks by Jira key so each key needs a single branch, commit and merge request."""
+        tasks = []
         for task in self.tasks:
-            branch_name = f"quotas_auto_{task['key']}"
+            # Normalize deltas once so modify_project can rely on integers
+            try:
+                cpu, ram = int(task.get('cpu') or 0), int(task.get('ram') or 0)
+            except (TypeError, ValueError) as e:
+                logger.error("Skipping task '%s': invalid CPU or RAM value: %s", task.get('key'), e)
+                continue
+            if not cpu and not ram:
+                logger.info("Skipping task '%s': no CPU or RAM changes requested.", task['key'])
+                continue
+            tasks.append({**task, 'cpu': cpu, 'ram': ram})
+
+        tasks.sort(key=lambda task: task['key'])
+        return [(key, list(group)) for key, group in groupby(tasks, key=lambda task: task['key'])]
+
+    def _process_task_group(self, group):
+        """Runs the full GitLab workflow for all tasks of a Jira key."""
+        key, tasks = group
+        try:
+            self._run_task_group(key, tasks)
+        except Exception as e:
+            logger.error("Failed to process task '%s': %s", key, e)
 
-            # Create or reset the branch from 'master'
-            self.create_branch(branch_name, 'master')
+    def _run_task_group(self, key, tasks):
+        """Creates a branch, applies all modifications to the affected files, commits them once and opens a merge request."""
+        branch_name = f"quotas_auto_{key}"
+        commit_message = f"chore: Update quotas for {key}"
 
-            project_file_path = f"{task['openstack']}/admin/projects.tf"
-            commit_message = f"chore: Update quotas for {task['key']}"
+        # An open merge request with the expected title means the task was already processed
+        existing_mrs = self.find_merge_requests(branch_name)
+        if existing_mrs and existing_mrs[0].title == commit_message:
+            logger.info("Merge Request with title '%s' already exists, skipping task '%s'.", commit_message, key)
+            return
+
+        # Create or reset the branch from 'master'
+        self.create_branch(branch_name, 'master')
+
+        tasks_by_file = {}
+        for task in tasks:
+            tasks_by_file.setdefault(f"{task['openstack']}/admin/projects.tf", []).append(task)
 
+        files = {}
+        for project_file_path, file_tasks in tasks_by_file.items():
             # Get the content from the branch
             original_content = self.get_file_content(project_file_path, branch_name)
             if original_content is None:
                 continue
 
-            modified_content = self.modify_project(
-                original_content,
-                task['project'],
-                task['cpu'],
-                task['ram']
-            )
+            # Apply every modification of the file in a single pass over the content
+            deltas = {}
+            for task in file_tasks:
+                cpu, ram = deltas.get(task['project'], (0, 0))
+                deltas[task['project']] = (cpu + task['cpu'], ram + task['ram'])
+            modified_content = self.modify_project_batch(original_content, deltas)
 
             if modified_content == original_content:
-                logging.info(f"No changes made to '{project_file_path}' for task '{task['key']}'.")
+                logger.info("No changes made to '%s' for task '%s'.", project_file_path, key)
                 continue
+            files[project_file_path] = (original_content, modified_content)
+
+        if not files:
+            return
+
+        # Commit changes of all files to the task-specific branch
+        self.commit_changes(
+            files=files,
+            branch_name=branch_name,
+            commit_message=commit_message
+        )
+
+        # Create a merge request to 'master'
+        self.create_merge_request(branch_name, commit_message, existing_mrs)
+
+    def process_tasks(self):
+        """Processes tasks grouped by key: creates a branch, modifies files, commits changes, and creates a merge request."""
+        if self.project is None:
+            logger.error("GitLab project is not initialized. Exiting process_tasks.")
+            return
 
-            # Commit changes to the task-specific branch
-            self.commit_changes(
-                file_path=project_file_path,
-                original_content=original_content,
-                modified_content=modified_content,
-                branch_name=branch_name,
-                commit_message=commit_message
-            )
-
-            # Create a merge request to 'master'
-            self.create_merge_request(branch_name, commit_message)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self._process_task_group, self.group_tasks()))
 
 
 def main():
@@ -1,10 +1,69 @@
 import argparse
 import logging
-import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 from jira import JIRA, JIRAError
+from requests.adapters import HTTPAdapter
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+JIRA_PAGE_SIZE = 100
+# Custom fields read from each issue
+OPENSTACK_FIELD = 'customfield_13627'
+CPU_FIELD = 'customfield_13637'
+RAM_FIELD = 'customfield_13638'
+PROJECTS_FIELD = 'customfield_13614'
+# Only these fields are requested so Jira does not serialize every field of every issue
+JIRA_FIELDS = ['description', 'comment', OPENSTACK_FIELD, CPU_FIELD, RAM_FIELD, PROJECTS_FIELD]
+
+
+def _orjson_response_hook(response, *args, **kwargs):
+    """Makes response.json() decode the body with orjson, which the Jira client uses for every payload."""
+    response.json = lambda **json_kwargs: orjson.loads(response.content)
+    return response
+
+
+def _make_task(raw):
+    """
+    Builds a task from a raw Jira issue without comments and description.
+
+    :param raw: Raw issue payload.
+    :return: Task dictionary, or None if the issue should be skipped.
+    """
+    _get = dict.get
+    key = raw['key']
+    try:
+        fields = raw['fields']
+        description = _get(fields, 'description')
+        comments = _get(_get(fields, 'comment', {}), 'total', 0)
+        if description or comments != 0:
+            return None
+
+        openstack_value = _get(_get(fields, OPENSTACK_FIELD, {}), 'value', None)
+        cpu_value = _get(fields, CPU_FIELD, None)
+        ram_value = _get(fields, RAM_FIELD, None)
+        cpu_value = int(cpu_value) if cpu_value else 0
+        # RAM is requested in GB while projects.tf stores MB
+        ram_value = int(ram_value * 1024) if isinstance(ram_value, (int, float)) else 0
+        projects_affected = _get(_get(fields, PROJECTS_FIELD, [{}])[0], 'value', 'Not specified').split(' ')[0].strip().lower()
+
+        if not cpu_value and not ram_value:
+            logger.info("Skipping issue %s: no CPU or RAM changes requested.", key)
+            return None
+
+        return {
+            'key': key,
+            'openstack': openstack_value.split()[0] if isinstance(openstack_value, str) else 'Not specified',
+            'cpu': cpu_value,
+            'ram': ram_value,
+            'project': projects_affected
+        }
+    except Exception as e:
+        logger.error("Error processing issue %s: %s", key, e)
+        return None
 
 
 class JiraManager:
@@ -22,6 +81,7 @@ class JiraManager:
         self.token = token
         self.jql = jql
         self.jira = None
+        self.workers = int(os.environ.get('JIRA_WORKERS', 8))
 
     def connect_to_jira(self):
         """
@@ -29,9 +89,15 @@ class JiraManager:
         """
         try:
             self.jira = JIRA(server=self.url, basic_auth=(self.login, self.token))
-            logging.info("Successfully connected to Jira.")
+            # Keep connections alive across paginated requests, with up to one connection per page worker
+            # in the Jira host pool; the Jira session handles retries itself
+            adapter = HTTPAdapter(pool_maxsize=self.workers)
+            self.jira._session.mount('https://', adapter)
+            self.jira._session.mount('http://', adapter)
+            self.jira._session.hooks['response'].append(_orjson_response_hook)
+            logger.info("Successfully connected to Jira.")
         except JIRAError as e:
-            logging.error(f"Failed to connect to Jira: {e}")
+            logger.error("Failed to connect to Jira: %s", e)
             raise
 
     def fetch_issues_by_jql(self):
@@ -41,24 +107,58 @@ class JiraManager:
         :return: List of issues.
         """
         try:
-            start_at = 0
-            max_results = 50
-            all_issues = []
-
-            while True:
-                issues = self.jira.search_issues(self.jql, startAt=start_at, maxResults=max_results)
-                if not issues:
-                    break
-
-                all_issues.extend(issues)
-                start_at += max_results
-
-            logging.info(f"Found {len(all_issues)} issues for query: {self.jql}.")
+            first_page = self.fetch_page(0)
+            all_issues = list(first_page)
+
+            next_page_token = getattr(first_page, 'nextPageToken', None)
+            # Servers may cap the page size below the requested one
+            page_size = first_page.maxResults or len(first_page)
+            if next_page_token:
+                # Jira Cloud pages with tokens, which can only be followed one after another
+                all_issues.extend(self.jira.enhanced_search_issues(
+                    self.jql,
+                    nextPageToken=next_page_token,
+                    maxResults=False,
+                    fields=list(JIRA_FIELDS)
+                ))
+            elif first_page.total is None or not page_size:
+                # Without a usable total or page size let the client page through all results
+                all_issues = self.jira.search_issues(
+                    self.jql,
+                    maxResults=False,
+                    fields=list(JIRA_FIELDS),
+                    validate_query=False
+                )
+            elif first_page.total > len(all_issues):
+                # Remaining pages are independent once the total is known, so fetch them concurrently
+                offsets = range(page_size, first_page.total, page_size)
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    for page in executor.map(lambda start_at: self.fetch_page(start_at, page_size), offsets):
+                        all_issues.extend(page)
+
+            logger.info("Found %s issues for query: %s.", len(all_issues), self.jql)
             return all_issues
         except JIRAError as e:
-            logging.error(f"Error executing JQL query: {e}")
+            logger.error("Error executing JQL query: %s", e)
             raise
 
+    def fetch_page(self, start_at, max_results=JIRA_PAGE_SIZE):
+        """
+        Fetches a single page of issues for the JQL query.
+
+        :param start_at: Index of the first issue in the page.
+        :param max_results: Number of issues to request.
+        :return: Result list of issues with the total number of matches.
+        """
+        # The client translates field names in place, so every call gets its own list
+        return self.jira.search_issues(
+            self.jql,
+            startAt=start_at,
+            maxResults=max_results,
+            fields=list(JIRA_FIELDS),
+            validate_query=False
+        )
+
     def filter_issues(self, issues):
         """
         Filters issues to include only those without comments and description.
@@ -66,31 +166,7 @@ class JiraManager:
         :param issues: List of issues from Jira.
         :return: Filtered list of issue objects.
         """
-        filtered_issues = []
-
-        for issue in issues:
-            try:
-                fields = issue.raw['fields']
-                description = fields.get('description')
-                comments = issue.fields.comment.total
-                openstack_value = fields.get('customfield_13627', {}).get('value', None)
-                cpu_value = fields.get('customfield_13637', None)
-                ram_value = fields.get('customfield_13638', None)
-                projects_affected = fields.get('customfield_13614', [{}])[0].get('value', 'Not specified').split(' ')[0].strip().lower()
-
-                if not description and comments == 0:
-                    filtered_issues.append({
-                        'key': issue.key,
-                        'openstack': openstack_value.split()[0] if isinstance(openstack_value, str) else 'Not specified',
-                        'cpu': cpu_value,
-                        'ram': ram_value * 1024 if isinstance(ram_value, float) else None,
-                        'project': projects_affected
-                    })
-            except Exception as e:
-                logging.error(f"Error processing issue {issue.key}: {e}")
-                continue
-
-        return filtered_issues
+        return [task for task in map(_make_task, (issue.raw for issue in issues)) if task is not None]
 
     def process_issues(self):
         """
@@ -99,8 +175,8 @@ class JiraManager:
         self.connect_to_jira()
         issues = self.fetch_issues_by_jql()
         filtered_issues = self.filter_issues(issues)
-        logging.info("Filtered Issues:")
-        logging.info(json.dumps(filtered_issues, indent=4, ensure_ascii=False))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Filtered Issues:\n%s", orjson.dumps(filtered_issues, option=orjson.OPT_INDENT_2).decode())
         return filtered_issues
 
 
@@ -4,6 +4,8 @@ import os
 from gitlab_module import GitLabManager
 from jira_module import JiraManager
 
+logger = logging.getLogger(__name__)
+
 
 def main():
     
@@ -38,7 +40,7 @@ def main():
 
     # Check if tasks are available
     if not tasks:
-        logging.info("No tasks found to process from Jira.")
+        logger.info("No tasks found to process from Jira.")
         return
 
     # Initialize GitLabManager with the tasks from Jira